@@ -14,6 +14,21 @@ try:
 except Exception as e:
     print("trusted_telegram_id:", e)
 
+try:
+    cur.execute("ALTER TABLE outbox_event ADD COLUMN next_attempt_at DATETIME;")
+    print("next_attempt_at criada.")
+except Exception as e:
+    print("next_attempt_at:", e)
+
+try:
+    cur.execute("ALTER TABLE outbox_event ADD COLUMN failed_at DATETIME;")
+    # Eventos que já tinham esgotado as tentativas passam para o estado de falha (dead-letter)
+    cur.execute("UPDATE outbox_event SET failed_at = CURRENT_TIMESTAMP "
+                "WHERE processed_at IS NULL AND attempts >= 5;")
+    print("failed_at criada.")
+except Exception as e:
+    print("failed_at:", e)
+
 conn.commit()
 conn.close()
 print("Pronto.")
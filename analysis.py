@@ -7,6 +7,8 @@ from datetime import datetime, timedelta
 import numpy as np
 import joblib  # NECESSÁRIO para carregar/salvar o modelo
 import os      # CORREÇÃO: NECESSÁRIO para usar os.path.exists
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 
 # Configuráveis
 MIN_RECORDS_FOR_MODEL = 5   
@@ -23,6 +25,15 @@ WARNING_HYPER = 180
 HYPO_DROP_RATE = -0.5
 HYPER_RISE_RATE = 0.5
 
+# Orçamento de tempo da análise: carregar e prever rodam na própria requisição; só o (re)treino
+# de um modelo ausente ou corrompido vai para uma thread separada (um por vez). Se o orçamento
+# acabar, a análise segue só com a taxa de mudança e o treino termina em segundo plano,
+# deixando o modelo salvo para as próximas chamadas.
+_train_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="glucose-train")
+_train_lock = threading.Lock()
+_train_future = None
+ANALYSIS_METRICS = {'budget_exceeded': 0}
+
 
 def calculate_rate_of_change(df):
     """
@@ -94,7 +105,11 @@ def train_model(records, model_filepath="glucose_model.pkl"):
         model = Ridge(alpha=1.0)
         model.fit(X, y)
 
-        joblib.dump(model, model_filepath)
+        # Grava em arquivo temporário e troca de uma vez: quem carrega o modelo em paralelo
+        # nunca lê um arquivo pela metade
+        tmp_filepath = f"{model_filepath}.tmp"
+        joblib.dump(model, tmp_filepath)
+        os.replace(tmp_filepath, model_filepath)
         print(f"Modelo salvo em {model_filepath}")
         return model
 
@@ -102,10 +117,75 @@ def train_model(records, model_filepath="glucose_model.pkl"):
         print(f"Erro em train_model: {e}")
         return None
 
-def predict_risk_v2(records, model_filepath="glucose_model.pkl"):
+def load_model(model_filepath="glucose_model.pkl"):
+    """Carrega o modelo salvo. Retorna None se não existir ou estiver corrompido."""
+    # CORREÇÃO: Usando os.path.exists corretamente
+    if not os.path.exists(model_filepath):
+        return None
+    try:
+        return joblib.load(model_filepath)
+    except Exception as e:
+        print(f"Erro ao carregar o modelo, tentando retreinar: {e}")
+        return None
+
+def load_or_train_model(df, records, model_filepath="glucose_model.pkl"):
+    """Carrega o modelo salvo; se não existir ou estiver corrompido, treina um novo (se houver dados)."""
+    model = load_model(model_filepath)
+    if model is None and len(df) >= MIN_RECORDS_FOR_MODEL:
+        model = train_model(records, model_filepath)
+    return model
+
+def train_model_in_background(records, model_filepath, time_budget):
+    """
+    Treina o modelo na thread de treino e espera no máximo time_budget segundos.
+    Se já houver um treino em andamento, espera por ele em vez de começar outro.
+    Retorna o modelo, ou None se o orçamento estourar (o treino continua em segundo plano).
+    """
+    global _train_future
+    with _train_lock:
+        if _train_future is None or _train_future.done():
+            _train_future = _train_executor.submit(train_model, records, model_filepath)
+        future = _train_future
+    try:
+        return future.result(timeout=time_budget)
+    except FutureTimeoutError:
+        with _train_lock:
+            ANALYSIS_METRICS['budget_exceeded'] += 1
+        print(f"Orçamento de tempo da análise ({time_budget}s) excedido; usando apenas a taxa de mudança.")
+        return None
+
+def _predict(model, df):
+    """Valor previsto em PREDICTION_MINUTES a partir das últimas leituras, ou None."""
+    # Prepara a entrada do modelo com as features de lag
+    df_lags = create_lag_features(df, LAG_PERIODS)
+    if df_lags.empty:
+        return None
+    last_features = df_lags.iloc[-1]
+    features_cols = [f'value_lag_{i}' for i in range(1, LAG_PERIODS + 1)]
+    X_pred = last_features[features_cols].values.reshape(1, -1)
+    return model.predict(X_pred)[0]
+
+def predict_with_model(df, records, model_filepath="glucose_model.pkl", time_budget=None):
+    """
+    Retorna (modelo, valor previsto em PREDICTION_MINUTES) ou (modelo/None, None).
+    Com time_budget (segundos), carregar e prever continuam na requisição; só o treino de um
+    modelo ausente ou corrompido respeita o orçamento (ver train_model_in_background).
+    """
+    if time_budget is None:
+        model = load_or_train_model(df, records, model_filepath)
+    else:
+        model = load_model(model_filepath)
+        if model is None and len(df) >= MIN_RECORDS_FOR_MODEL:
+            model = train_model_in_background(records, model_filepath, time_budget)
+    if not model:
+        return None, None
+    return model, _predict(model, df)
+
+def predict_risk_v2(records, model_filepath="glucose_model.pkl", time_budget=None):
     """
     Analisa o risco de glicemia usando a taxa de mudança imediata 
     e faz uma previsão usando o modelo treinado (se disponível).
+    Com time_budget (segundos), se o modelo não responder a tempo, usa só a taxa de mudança.
     """
     try:
         if not records:
@@ -130,61 +210,39 @@ def predict_risk_v2(records, model_filepath="glucose_model.pkl"):
         predicted_value_mgdl = None
         predicted_time = None
         
-        # 1. Tentar carregar/treinar o modelo
-        model = None
-        # CORREÇÃO: Usando os.path.exists corretamente
-        if os.path.exists(model_filepath):
-            try:
-                model = joblib.load(model_filepath)
-            except Exception as e:
-                # Tenta retreinar se o modelo estiver corrompido ou o arquivo não puder ser lido
-                print(f"Erro ao carregar o modelo, tentando retreinar: {e}")
-                if len(df) >= MIN_RECORDS_FOR_MODEL:
-                    model = train_model(records, model_filepath)
-        elif len(df) >= MIN_RECORDS_FOR_MODEL:
-            # Se não existe, tenta treinar se houver dados suficientes
-            model = train_model(records, model_filepath)
-
-        # 2. Previsão baseada em ML (se o modelo existe)
-        if model:
-            # Prepara a entrada do modelo com as features de lag
-            df_lags = create_lag_features(df, LAG_PERIODS)
-            if not df_lags.empty:
-                last_features = df_lags.iloc[-1]
-                features_cols = [f'value_lag_{i}' for i in range(1, LAG_PERIODS + 1)]
-                X_pred = last_features[features_cols].values.reshape(1, -1)
-                
-                predicted_value_mgdl = model.predict(X_pred)[0]
-                predicted_time = time_ultimo + timedelta(minutes=PREDICTION_MINUTES)
-                
-                # A) Risco Crítico baseado em ML
-                if predicted_value_mgdl < NORMAL_RANGE_LOW:
-                    message = (f"🚨 **Risco Imediato de Hipoglicemia:** A IA prevê um nível de {predicted_value_mgdl:.0f} mg/dL "
-                               f"em {PREDICTION_MINUTES} minutos. Tome medidas urgentes!")
-                    return {
-                        "risk_level": "HIGH",
-                        "message": message,
-                        "predicted_time": predicted_time.isoformat(),
-                        "predicted_value": predicted_value_mgdl
-                    }
-                elif predicted_value_mgdl > WARNING_HYPER:
-                    message = (f"🚨 **Risco Imediato de Hiperglicemia:** A IA prevê um nível de {predicted_value_mgdl:.0f} mg/dL "
-                               f"em {PREDICTION_MINUTES} minutos. Monitore de perto e ajuste a medicação se necessário.")
-                    return {
-                        "risk_level": "HIGH",
-                        "message": message,
-                        "predicted_time": predicted_time.isoformat(),
-                        "predicted_value": predicted_value_mgdl
-                    }
-                elif predicted_value_mgdl > NORMAL_RANGE_HIGH or predicted_value_mgdl < WARNING_HYPO:
-                    message = (f"⚠️ **Previsão de Alerta:** A IA prevê um nível de {predicted_value_mgdl:.0f} mg/dL "
-                               f"em {PREDICTION_MINUTES} minutos. Fique atento e monitore novamente.")
-                    return {
-                        "risk_level": "MEDIUM",
-                        "message": message,
-                        "predicted_time": predicted_time.isoformat(),
-                        "predicted_value": predicted_value_mgdl
-                    }
+        # 1-2. Carregar/treinar o modelo e prever (respeitando o orçamento de tempo, se houver)
+        model, predicted_value_mgdl = predict_with_model(df, records, model_filepath, time_budget)
+        if model and predicted_value_mgdl is not None:
+            predicted_time = time_ultimo + timedelta(minutes=PREDICTION_MINUTES)
+
+            # A) Risco Crítico baseado em ML
+            if predicted_value_mgdl < NORMAL_RANGE_LOW:
+                message = (f"🚨 **Risco Imediato de Hipoglicemia:** A IA prevê um nível de {predicted_value_mgdl:.0f} mg/dL "
+                           f"em {PREDICTION_MINUTES} minutos. Tome medidas urgentes!")
+                return {
+                    "risk_level": "HIGH",
+                    "message": message,
+                    "predicted_time": predicted_time.isoformat(),
+                    "predicted_value": predicted_value_mgdl
+                }
+            elif predicted_value_mgdl > WARNING_HYPER:
+                message = (f"🚨 **Risco Imediato de Hiperglicemia:** A IA prevê um nível de {predicted_value_mgdl:.0f} mg/dL "
+                           f"em {PREDICTION_MINUTES} minutos. Monitore de perto e ajuste a medicação se necessário.")
+                return {
+                    "risk_level": "HIGH",
+                    "message": message,
+                    "predicted_time": predicted_time.isoformat(),
+                    "predicted_value": predicted_value_mgdl
+                }
+            elif predicted_value_mgdl > NORMAL_RANGE_HIGH or predicted_value_mgdl < WARNING_HYPO:
+                message = (f"⚠️ **Previsão de Alerta:** A IA prevê um nível de {predicted_value_mgdl:.0f} mg/dL "
+                           f"em {PREDICTION_MINUTES} minutos. Fique atento e monitore novamente.")
+                return {
+                    "risk_level": "MEDIUM",
+                    "message": message,
+                    "predicted_time": predicted_time.isoformat(),
+                    "predicted_value": predicted_value_mgdl
+                }
 
         # 3. Análise da Taxa de Mudança (Fallback/Suplemento)
         rate_of_change = calculate_rate_of_change(df)
@@ -1,17 +1,22 @@
 # app.py
 import os
 import re
+import json
 from flask import Flask, request, jsonify, current_app, send_from_directory
 from flask_cors import CORS
 from datetime import datetime, timezone
 import requests
-from analysis import train_model, predict_risk_v2 # Depende de analysis.py
-from database import db, User, GlucoseRecord, ChatMessage # Depende de database.py
+from analysis import train_model, predict_risk_v2, ANALYSIS_METRICS # Depende de analysis.py
+from database import db, User, GlucoseRecord, ChatMessage, MetricSnapshot # Depende de database.py
 from auth import create_auth_token, auth_required # Depende de auth.py
+from outbox import enqueue_event, outbox_counts, RetryLater # Fila de eventos (outbox.py)
+from retention import load_archived_records # Histórico arquivado (retention.py)
+from resilience import CircuitBreaker, CircuitOpenError # Circuit breaker (resilience.py)
 from werkzeug.security import generate_password_hash, check_password_hash
 
 # Configurações de Padrão
 LOW_GLUCOSE_THRESHOLD = float(os.environ.get('LOW_GLUCOSE_THRESHOLD', 70.0))
+ANALYSIS_TIME_BUDGET = float(os.environ.get('ANALYSIS_TIME_BUDGET', 2.0))  # segundos
 EMAIL_MENTION_PATTERN = re.compile(r"@[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}")
 
 # Config
@@ -29,9 +34,19 @@ with APP.app_context():
 # Telegram config
 TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN')
 TELEGRAM_ENABLED = str(os.environ.get('TELEGRAM_ENABLED', '')).lower() in ('1', 'true', 'yes')
+TELEGRAM_TIMEOUT = float(os.environ.get('TELEGRAM_TIMEOUT', 10))
+TELEGRAM_BREAKER = CircuitBreaker('telegram',
+                                  failure_threshold=int(os.environ.get('TELEGRAM_BREAKER_THRESHOLD', 5)),
+                                  reset_timeout=float(os.environ.get('TELEGRAM_BREAKER_RESET_SECONDS', 60)))
 
-def send_telegram_message(chat_id: str, text: str):
-    """Send message to Telegram chat_id using bot token if enabled"""
+class TelegramSendError(Exception):
+    """Telegram está habilitado e configurado, mas o envio falhou (o evento da outbox deve ser repetido)."""
+
+
+def send_telegram_message(chat_id: str, text: str, raise_on_failure: bool = False):
+    """Send message to Telegram chat_id using bot token if enabled.
+    With raise_on_failure, a failed send raises TelegramSendError (or CircuitOpenError if skipped)
+    instead of returning False."""
     if not TELEGRAM_ENABLED:
         current_app.logger.debug("Telegram disabled (TELEGRAM_ENABLED!=1). Not sending.")
         return False
@@ -41,18 +56,39 @@ def send_telegram_message(chat_id: str, text: str):
     if not chat_id:
         current_app.logger.debug("No chat_id provided; skipping telegram send.")
         return False
+    # Com o circuito aberto (Telegram falhando seguidamente) o envio é pulado sem esperar o timeout
+    if not TELEGRAM_BREAKER.allow():
+        current_app.logger.warning("Telegram circuit open; skipping send to chat_id %s.", chat_id)
+        if raise_on_failure:
+            raise CircuitOpenError(TELEGRAM_BREAKER.name, TELEGRAM_BREAKER.retry_after())
+        return False
     try:
         url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
         payload = {"chat_id": str(chat_id), "text": str(text)}
-        r = requests.post(url, json=payload, timeout=10)
+        r = requests.post(url, json=payload, timeout=TELEGRAM_TIMEOUT)
         current_app.logger.debug("Telegram send status: %s %s", r.status_code, r.text)
-        return r.ok
+        # Erros 4xx (ex.: chat_id inválido) são do pedido, não indisponibilidade do Telegram
+        if r.status_code >= 500 or r.status_code == 429:
+            TELEGRAM_BREAKER.record_failure()
+        else:
+            TELEGRAM_BREAKER.record_success()
     except Exception as e:
+        TELEGRAM_BREAKER.record_failure()
         current_app.logger.exception("Error sending Telegram message: %s", e)
+        if raise_on_failure:
+            raise TelegramSendError(str(e)) from e
         return False
+    if not r.ok and raise_on_failure:
+        raise TelegramSendError(f"Telegram respondeu {r.status_code}: {r.text[:300]}")
+    return r.ok
+
+def notify_telegram(chat_id: str, text: str):
+    """Agenda o envio na outbox (um evento por mensagem, repetido até ser entregue). Não faz commit."""
+    if chat_id:
+        enqueue_event('telegram_message', {'chat_id': str(chat_id), 'text': str(text)})
 
 def send_emergency_alert(user: User, is_critical: bool, report_info: dict = None):
-    """Envia um alerta crítico para o contato de confiança e o usuário via Telegram."""
+    """Agenda (outbox) um alerta crítico para o contato de confiança e o usuário via Telegram. Não faz commit."""
     if report_info is None:
         report_info = {'value': 'N/A', 'risk_level': 'N/A', 'message': 'Detalhes de análise indisponíveis.'}
 
@@ -63,11 +99,11 @@ def send_emergency_alert(user: User, is_critical: bool, report_info: dict = None
 
     # 1) Enviar para o contato de confiança (se configurado)
     if user.trusted_telegram_id:
-        send_telegram_message(user.trusted_telegram_id, f"🚨 ALERTA DE EMERGÊNCIA (Confiança) 🚨\n{message}")
+        notify_telegram(user.trusted_telegram_id, f"🚨 ALERTA DE EMERGÊNCIA (Confiança) 🚨\n{message}")
 
     # 2) Enviar para o usuário (eles devem receber todas as notificações)
     if user.telegram_chat_id:
-        send_telegram_message(user.telegram_chat_id, f"⚠️ ALERTA DE MONITORAMENTO ⚠️\n{message}")
+        notify_telegram(user.telegram_chat_id, f"⚠️ ALERTA DE MONITORAMENTO ⚠️\n{message}")
 
 
 # -------------------------
@@ -154,21 +190,19 @@ def create_record(current_user):
     
     r = GlucoseRecord(value=value, user_id=current_user.id, meal_time=meal_time, exercise_time=exercise_time, symptoms=symptoms)
     db.session.add(r)
+    db.session.flush()  # obtém r.id sem commit
+
+    # Notificações são enviadas pelo consumidor da outbox (python outbox.py)
+    enqueue_event('record_created', {
+        'record_id': r.id,
+        'user_id': current_user.id,
+        'value': value,
+        'timestamp': r.timestamp.isoformat(),
+        'meal_time': meal_time,
+        'symptoms': symptoms
+    })
     db.session.commit()
 
-    # ------------- Notifications -------------
-    # 1) Notificar o próprio usuário (via Telegram)
-    user_msg = f"[Clarity Health] Novo registro de glicemia: {value} mg/dL em {r.timestamp.strftime('%Y-%m-%d %H:%M:%S')}."
-    if meal_time: user_msg += f" Última refeição: {meal_time}."
-    if symptoms: user_msg += f" Sintomas: {str(symptoms)[:300]}."
-    if current_user.telegram_chat_id:
-        send_telegram_message(current_user.telegram_chat_id, user_msg)
-
-    # 2) Se glicemia muito baixa (alerta crítico), notificar contato de confiança/emergência
-    if value <= LOW_GLUCOSE_THRESHOLD:
-        report_info = {'value': value, 'risk_level': 'HIGH', 'message': f'Nível de glicemia CRITICAMENTE BAIXO: {value} mg/dL.'}
-        send_emergency_alert(current_user, is_critical=True, report_info=report_info)
-
     return jsonify({
         'id': r.id,
         'value': r.value,
@@ -185,7 +219,7 @@ def get_records(current_user):
     # Retorna registros ordenados do mais recente para o mais antigo (para exibição em tabela)
     records = GlucoseRecord.query.filter_by(user_id=current_user.id)\
                                  .order_by(GlucoseRecord.timestamp.desc()).all()
-    return jsonify([
+    result = [
         {
             'id': r.id,
             'value': r.value,
@@ -194,7 +228,12 @@ def get_records(current_user):
             'exercise_time': r.exercise_time,
             'symptoms': r.symptoms
         } for r in records
-    ]), 200
+    ]
+    # ?include_archive=1 inclui as leituras movidas para o arquivo (retention.py)
+    if str(request.args.get('include_archive', '')).lower() in ('1', 'true', 'yes'):
+        result.extend(load_archived_records(current_user.id))
+        result.sort(key=lambda rec: rec['timestamp'], reverse=True)
+    return jsonify(result), 200
 
 # -------------------------
 # Glucose analysis (Corrected)
@@ -207,14 +246,19 @@ def analyze_glucose(current_user):
     records = GlucoseRecord.query.filter_by(user_id=current_user.id)\
                                  .order_by(GlucoseRecord.timestamp.asc()).all()
 
-    if not records:
+    # ?include_archive=1 analisa também o histórico arquivado (retention.py)
+    archived = []
+    if str(request.args.get('include_archive', '')).lower() in ('1', 'true', 'yes'):
+        archived = load_archived_records(current_user.id)
+
+    if not records and not archived:
         return jsonify({
             "message": "Nenhum registro encontrado.",
             "risk_level": "N/A"
         }), 200
 
     # Converter para formato de dicionário
-    all_records = []
+    all_records = [{k: r[k] for k in ("value", "timestamp", "meal_time", "exercise_time", "symptoms")} for r in archived]
     for r in records:
         all_records.append({
             "value": r.value,
@@ -224,11 +268,14 @@ def analyze_glucose(current_user):
             "symptoms": r.symptoms
         })
 
+    if archived:
+        all_records.sort(key=lambda rec: rec['timestamp'])
+
     # Analisar o risco
     # CORREÇÃO: Adicionando o segundo argumento posicional "glucose_model.pkl"
     # que a função predict_risk_v2() do analysis.py está esperando.
     try:
-        analysis_result = predict_risk_v2(all_records, "glucose_model.pkl") 
+        analysis_result = predict_risk_v2(all_records, "glucose_model.pkl", time_budget=ANALYSIS_TIME_BUDGET)
     except TypeError as e:
         # Se o TypeError persistir, é porque a função no analysis.py pode estar definida
         # para esperar exatamente 2 argumentos sem valor default. 
@@ -248,6 +295,7 @@ def analyze_glucose(current_user):
             'risk_level': analysis_result['risk_level'],
             'message': analysis_result['message']
         })
+        db.session.commit()
         
     return jsonify(analysis_result), 200
 
@@ -282,22 +330,16 @@ def send_chat_message(current_user):
 
     m = ChatMessage(user_id=current_user.id, username=current_user.email, content=content)
     db.session.add(m)
+    db.session.flush()  # obtém m.id sem commit
+
+    # Notificações (autor e menções) são enviadas pelo consumidor da outbox
+    enqueue_event('chat_message', {
+        'message_id': m.id,
+        'user_id': current_user.id,
+        'content': content
+    })
     db.session.commit()
 
-    # Notify the author (user) via Telegram (they want to receive all notifications)
-    if current_user.telegram_chat_id:
-        send_telegram_message(current_user.telegram_chat_id, f"[Chat] Você enviou uma mensagem: {content[:300]}")
-
-    # Detect mentions like @email@domain.com
-    mentions = EMAIL_MENTION_PATTERN.findall(content)
-    for email in mentions:
-        # Remove the leading '@' for the database lookup
-        user_email = email[1:]
-        user = User.query.filter_by(email=user_email).first()
-        if user and user.telegram_chat_id:
-            # notify mentioned user
-            send_telegram_message(user.telegram_chat_id, f"[Mencionado] Você foi mencionado no chat por {current_user.email}: {content[:300]}")
-
     return jsonify({
         'id': m.id,
         'user_id': m.user_id,
@@ -314,9 +356,14 @@ def send_chat_message(current_user):
 def trigger_emergency(current_user):
     # Simula um registro crítico para acionar o alerta (o ideal seria um registro real ou um sinal específico)
     report_info = {'value': 'ALERTA MANUAL', 'risk_level': 'HIGH', 'message': 'O usuário acionou o botão de emergência manualmente.'}
-    send_emergency_alert(current_user, is_critical=True, report_info=report_info)
+    enqueue_event('emergency', {
+        'user_id': current_user.id,
+        'is_critical': True,
+        'report_info': report_info
+    })
+    db.session.commit()
     
-    return jsonify({'message': 'Alerta de emergência acionado! Notificação enviada ao contato de confiança (se configurado).'}), 200
+    return jsonify({'message': 'Alerta de emergência registrado! A notificação ao contato de confiança (se configurado) foi colocada na fila de envio.'}), 200
 
 @APP.route('/api/chat/emergency', methods=['POST'])
 @auth_required
@@ -330,20 +377,130 @@ def send_emergency_chat_message(current_user):
     emergency_content = f"🚨 MENSAGEM DE EMERGÊNCIA: {content.strip()[:400]}"
     m = ChatMessage(user_id=current_user.id, username=current_user.email, content=emergency_content)
     db.session.add(m)
-    db.session.commit()
 
+    # Envios agendados na outbox, na mesma commit da mensagem
     # 1. Envia a mensagem de chat para o usuário (via Telegram)
     if current_user.telegram_chat_id:
-        send_telegram_message(current_user.telegram_chat_id, f"[Chat Emergência] Você enviou: {emergency_content}")
+        notify_telegram(current_user.telegram_chat_id, f"[Chat Emergência] Você enviou: {emergency_content}")
 
     # 2. Envia um alerta mais direto para o contato de confiança
     if current_user.trusted_telegram_id:
          message_trusted = f"⚠️ ALERTA: Mensagem de emergência de {current_user.email}: {emergency_content}"
-         send_telegram_message(current_user.trusted_telegram_id, message_trusted)
+         notify_telegram(current_user.trusted_telegram_id, message_trusted)
+    db.session.commit()
 
-    return jsonify({'message': 'Mensagem de emergência enviada e notificação acionada.'}), 201
+    return jsonify({'message': 'Mensagem de emergência enviada; notificação colocada na fila de envio.'}), 201
 
 
+# -------------------------
+# Metrics
+# GET /api/metrics
+# -------------------------
+METRIC_SNAPSHOT_HEARTBEAT_SECONDS = 60
+_last_breaker_snapshot = None
+
+def save_worker_metrics():
+    """
+    Chamado pelo consumidor da outbox após cada lote: grava o estado do circuit breaker do Telegram
+    (que só muda nesse processo) na tabela metric_snapshot. Só escreve se mudou ou a cada
+    METRIC_SNAPSHOT_HEARTBEAT_SECONDS, para updated_at indicar que o worker está vivo.
+    """
+    global _last_breaker_snapshot
+    snapshot = TELEGRAM_BREAKER.snapshot()
+    row = db.session.get(MetricSnapshot, 'telegram_breaker')
+    now = datetime.utcnow()
+    if row and snapshot == _last_breaker_snapshot and (now - row.updated_at).total_seconds() < METRIC_SNAPSHOT_HEARTBEAT_SECONDS:
+        return
+    if row is None:
+        row = MetricSnapshot(name='telegram_breaker')
+        db.session.add(row)
+    row.data = json.dumps(snapshot)
+    row.updated_at = now
+    db.session.commit()
+    _last_breaker_snapshot = snapshot
+
+def load_worker_metrics(name: str):
+    """Lê a métrica gravada pelo consumidor da outbox (None se o worker nunca gravou)."""
+    row = db.session.get(MetricSnapshot, name)
+    if row is None:
+        return None
+    return dict(json.loads(row.data), updated_at=row.updated_at.isoformat())
+
+@APP.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    # O breaker vem do consumidor da outbox (processo que envia ao Telegram); analysis é por processo web
+    return jsonify({
+        'telegram_breaker': load_worker_metrics('telegram_breaker'),
+        'analysis': dict(ANALYSIS_METRICS, time_budget=ANALYSIS_TIME_BUDGET),
+        'outbox': outbox_counts()
+    }), 200
+
+
+# -------------------------
+# Outbox handlers (executados pelo consumidor: python outbox.py)
+# Os handlers de domínio apenas geram eventos telegram_message (commit junto com o evento
+# de origem); cada envio é repetido isoladamente até ser entregue ou esgotar as tentativas.
+# -------------------------
+def handle_telegram_message(payload: dict):
+    try:
+        send_telegram_message(payload['chat_id'], payload['text'], raise_on_failure=True)
+    except CircuitOpenError as e:
+        # Envio pulado pelo circuit breaker: o evento fica pendente até o circuito liberar
+        raise RetryLater(max(e.retry_after, 1.0), str(e))
+
+def handle_record_created(payload: dict):
+    user = db.session.get(User, payload['user_id'])
+    if not user:
+        return
+    value = payload['value']
+    timestamp = datetime.fromisoformat(payload['timestamp'])
+
+    # 1) Notificar o próprio usuário (via Telegram)
+    user_msg = f"[Clarity Health] Novo registro de glicemia: {value} mg/dL em {timestamp.strftime('%Y-%m-%d %H:%M:%S')}."
+    if payload.get('meal_time'): user_msg += f" Última refeição: {payload['meal_time']}."
+    if payload.get('symptoms'): user_msg += f" Sintomas: {str(payload['symptoms'])[:300]}."
+    if user.telegram_chat_id:
+        notify_telegram(user.telegram_chat_id, user_msg)
+
+    # 2) Se glicemia muito baixa (alerta crítico), notificar contato de confiança/emergência
+    if value <= LOW_GLUCOSE_THRESHOLD:
+        report_info = {'value': value, 'risk_level': 'HIGH', 'message': f'Nível de glicemia CRITICAMENTE BAIXO: {value} mg/dL.'}
+        send_emergency_alert(user, is_critical=True, report_info=report_info)
+
+def handle_chat_message(payload: dict):
+    author = db.session.get(User, payload['user_id'])
+    if not author:
+        return
+    content = payload['content']
+
+    # Notify the author (user) via Telegram (they want to receive all notifications)
+    if author.telegram_chat_id:
+        notify_telegram(author.telegram_chat_id, f"[Chat] Você enviou uma mensagem: {content[:300]}")
+
+    # Detect mentions like @email@domain.com
+    mentions = EMAIL_MENTION_PATTERN.findall(content)
+    for email in mentions:
+        # Remove the leading '@' for the database lookup
+        user_email = email[1:]
+        user = User.query.filter_by(email=user_email).first()
+        if user and user.telegram_chat_id:
+            # notify mentioned user
+            notify_telegram(user.telegram_chat_id, f"[Mencionado] Você foi mencionado no chat por {author.email}: {content[:300]}")
+
+def handle_emergency(payload: dict):
+    user = db.session.get(User, payload['user_id'])
+    if not user:
+        return
+    send_emergency_alert(user, is_critical=payload.get('is_critical', True), report_info=payload.get('report_info'))
+
+# Novos consumidores (ex.: atualização de análise, rollups) entram aqui
+OUTBOX_HANDLERS = {
+    'telegram_message': handle_telegram_message,
+    'record_created': handle_record_created,
+    'chat_message': handle_chat_message,
+    'emergency': handle_emergency,
+}
+
 # -------------------------
 # Static File Serving (Index.html and others)
 # -------------------------
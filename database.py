@@ -34,3 +34,21 @@ class ChatMessage(db.Model):
     timestamp = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
     user = db.relationship('User', backref=db.backref('chat_messages', lazy=True))
+
+class OutboxEvent(db.Model):
+    __tablename__ = 'outbox_event'
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(64), nullable=False)                 # ex: record_created, chat_message, emergency
+    payload = db.Column(db.Text, nullable=False)                    # JSON com os dados do evento
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    last_error = db.Column(db.Text, nullable=True)
+    processed_at = db.Column(db.DateTime, nullable=True, index=True)  # NULL = pendente
+    next_attempt_at = db.Column(db.DateTime, nullable=True)         # backoff entre tentativas (NULL = já)
+    failed_at = db.Column(db.DateTime, nullable=True)               # dead-letter: esgotou OUTBOX_MAX_ATTEMPTS
+
+class MetricSnapshot(db.Model):
+    __tablename__ = 'metric_snapshot'
+    name = db.Column(db.String(64), primary_key=True)               # ex: telegram_breaker
+    data = db.Column(db.Text, nullable=False)                       # JSON gravado pelo processo dono da métrica
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
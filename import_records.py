@@ -0,0 +1,221 @@
+# import_records.py
+# Importação em massa de histórico de glicemia (CSV ou NDJSON exportados de glicosímetros).
+#
+# Não passa pela API: lê o arquivo em blocos (streaming), valida/normaliza os dados com pandas
+# de forma vetorizada e insere com executemany, uma transação por bloco. Nenhuma notificação
+# é enviada (nem eventos na outbox). O progresso fica salvo na tabela import_progress na mesma
+# transação de cada bloco, então basta rodar o mesmo comando de novo para retomar.
+#
+# Uso:
+#   python import_records.py --user-id 1 leituras.csv
+#   python import_records.py --user-id 1 --format ndjson --timezone America/Sao_Paulo export.ndjson
+#   python import_records.py --user-id 1 --date-format "%d/%m/%Y %H:%M" medidor.csv
+#   python import_records.py --user-id 1 --epoch export.csv   (datas numéricas = segundos desde 1970)
+
+import os
+import io
+import sys
+import time
+import argparse
+import sqlite3
+from itertools import islice
+import pandas as pd
+
+DEFAULT_DB_PATH = "instance/clarity_health.db"
+DEFAULT_CHUNK_SIZE = 100_000
+# ISO8601 aceita as variações comuns (com/sem segundos, 'T' ou espaço, 'Z' ou offset) de forma vetorizada
+DEFAULT_DATE_FORMAT = 'ISO8601'
+REJECTED_SAMPLE_SIZE = 5
+# Datas com fuso explícito no final: Z, +03, -0300, -03:00
+AWARE_TS_PATTERN = r'(?:Z|[+-]\d{2}(?::?\d{2})?)$'
+
+# Colunas aceitas no arquivo -> coluna da tabela glucose_record
+COLUMN_ALIASES = {
+    'value': 'value', 'valorGlicemia': 'value', 'glucose': 'value',
+    'timestamp': 'timestamp', 'datetime': 'timestamp', 'date': 'timestamp',
+    'meal_time': 'meal_time', 'ultimaRefeicao': 'meal_time',
+    'exercise_time': 'exercise_time', 'ultimoExercicio': 'exercise_time',
+    'symptoms': 'symptoms', 'sintomas': 'symptoms',
+}
+OPTIONAL_COLUMNS = ['meal_time', 'exercise_time', 'symptoms']
+
+INSERT_SQL = ("INSERT INTO glucose_record (value, user_id, timestamp, meal_time, exercise_time, symptoms) "
+              "VALUES (?, ?, ?, ?, ?, ?)")
+
+
+def read_chunks(path, fmt, chunk_size, skip_rows=0):
+    """Gera DataFrames de até chunk_size linhas, pulando as skip_rows primeiras linhas de dados."""
+    if fmt == 'csv':
+        # range(1, ...) preserva o cabeçalho
+        reader = pd.read_csv(path, chunksize=chunk_size, dtype=str, keep_default_na=False,
+                             skiprows=range(1, skip_rows + 1) if skip_rows else None)
+        for chunk in reader:
+            yield chunk
+    else:
+        with open(path, 'r', encoding='utf-8') as f:
+            lines = (line for line in f if line.strip())
+            for _ in islice(lines, skip_rows):
+                pass
+            while True:
+                block = list(islice(lines, chunk_size))
+                if not block:
+                    break
+                yield pd.read_json(io.StringIO(''.join(block)), lines=True, dtype=False,
+                               convert_dates=False, keep_default_dates=False)
+
+
+def parse_timestamps(raw_ts, timezone=None, date_format=DEFAULT_DATE_FORMAT, epoch=False):
+    """
+    Converte a coluna de data/hora para datetime UTC (vetorizado). Valores inválidos viram NaT.
+    - Com epoch=True, cada linha numérica (inclusive como texto no CSV) é lida como segundos desde
+      1970 em UTC; as demais seguem date_format. Sem epoch nada é lido como epoch, para datas
+      compactas como 20240101 não virarem 1970.
+    - Datas com fuso explícito são convertidas para UTC, mesmo com offsets diferentes (horário de verão).
+    - Datas sem fuso são interpretadas em `timezone` (padrão UTC).
+    """
+    text_ts = raw_ts.astype(str).str.strip()
+    filled = raw_ts.notna() & (text_ts != '')
+    ts = pd.Series(pd.NaT, index=raw_ts.index, dtype='datetime64[ns, UTC]')
+    if epoch:
+        seconds = pd.to_numeric(raw_ts.where(filled), errors='coerce')
+        numeric = seconds.notna()
+        if numeric.any():
+            ts[numeric] = pd.to_datetime(seconds[numeric], unit='s', utc=True, errors='coerce')
+        filled &= ~numeric
+
+    # Com e sem fuso separados mesmo sem timezone: no mesmo to_datetime, o pandas aplica a uma
+    # data sem fuso o offset da linha anterior
+    aware = filled & text_ts.str.contains(AWARE_TS_PATTERN, regex=True)
+    naive = filled & ~aware
+    if aware.any():
+        ts[aware] = pd.to_datetime(text_ts[aware], errors='coerce', utc=True, format=date_format)
+    if naive.any():
+        local = pd.to_datetime(text_ts[naive], errors='coerce', format=date_format)
+        ts[naive] = local.dt.tz_localize(timezone or 'UTC', ambiguous='NaT', nonexistent='NaT').dt.tz_convert('UTC')
+    return ts
+
+
+def normalize_chunk(df, user_id, timezone=None, date_format=DEFAULT_DATE_FORMAT, epoch=False):
+    """
+    Valida e normaliza um bloco.
+    Retorna (linhas prontas para executemany, número de linhas rejeitadas, exemplos de rejeitadas).
+    Os exemplos são (posição no bloco, value, timestamp) com os valores originais do arquivo.
+    Timestamps são convertidos para UTC sem timezone, no mesmo formato que o SQLAlchemy grava.
+    """
+    df = df.rename(columns={c: COLUMN_ALIASES[c] for c in df.columns if c in COLUMN_ALIASES})
+    if 'value' not in df.columns or 'timestamp' not in df.columns:
+        raise ValueError("O arquivo precisa ter as colunas de valor (value) e data/hora (timestamp).")
+
+    values = pd.to_numeric(df['value'], errors='coerce')
+    ts = parse_timestamps(df['timestamp'], timezone, date_format, epoch)
+
+    valid = values.notna() & (values > 0) & ts.notna()
+    out = pd.DataFrame({
+        'value': values[valid].astype(float),
+        'user_id': user_id,
+        'timestamp': ts[valid].dt.tz_localize(None).dt.strftime('%Y-%m-%d %H:%M:%S.%f'),
+    })
+    for col in OPTIONAL_COLUMNS:
+        if col in df.columns:
+            col_values = df.loc[valid, col].astype(object)
+            out[col] = col_values.where(col_values.notna() & (col_values != ''), None)
+        else:
+            out[col] = None
+
+    rows = list(out.astype(object).itertuples(index=False, name=None))
+    rejected_positions = (~valid).to_numpy().nonzero()[0][:REJECTED_SAMPLE_SIZE]
+    samples = [(int(i), df['value'].iloc[i], df['timestamp'].iloc[i]) for i in rejected_positions]
+    return rows, int((~valid).sum()), samples
+
+
+def ensure_progress_table(conn):
+    conn.execute("CREATE TABLE IF NOT EXISTS import_progress ("
+                 "source TEXT PRIMARY KEY, rows_done INTEGER NOT NULL, updated_at TEXT NOT NULL)")
+    conn.commit()
+
+
+def get_rows_done(conn, source):
+    row = conn.execute("SELECT rows_done FROM import_progress WHERE source = ?", (source,)).fetchone()
+    return row[0] if row else 0
+
+
+def import_file(path, user_id, db_path=DEFAULT_DB_PATH, fmt=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                timezone=None, restart=False, date_format=DEFAULT_DATE_FORMAT, epoch=False):
+    """Importa o arquivo para glucose_record. Retorna (inseridas, rejeitadas, segundos)."""
+    fmt = fmt or ('ndjson' if path.lower().endswith(('.ndjson', '.jsonl', '.json')) else 'csv')
+    source = f"{os.path.abspath(path)}#user={user_id}"
+
+    conn = sqlite3.connect(db_path)
+    try:
+        # Durabilidade por transação continua garantida pelo journal; só reduz fsyncs
+        conn.execute("PRAGMA synchronous = NORMAL")
+        if not conn.execute("SELECT 1 FROM user WHERE id = ?", (user_id,)).fetchone():
+            raise ValueError(f"Usuário {user_id} não encontrado em {db_path}.")
+        ensure_progress_table(conn)
+
+        if restart:
+            conn.execute("DELETE FROM import_progress WHERE source = ?", (source,))
+            conn.commit()
+        rows_done = get_rows_done(conn, source)
+        if rows_done:
+            print(f"Retomando {path} a partir da linha {rows_done}.")
+
+        inserted = rejected = 0
+        rejected_samples = []
+        started = time.perf_counter()
+        for chunk in read_chunks(path, fmt, chunk_size, skip_rows=rows_done):
+            rows, bad, samples = normalize_chunk(chunk, user_id, timezone, date_format, epoch)
+            # Mostra alguns exemplos para o usuário perceber formato de data/valor inesperado
+            for position, raw_value, raw_ts in samples[:REJECTED_SAMPLE_SIZE - len(rejected_samples)]:
+                rejected_samples.append((rows_done + position + 1, raw_value, raw_ts))
+                print(f"Linha {rows_done + position + 1} rejeitada: value={raw_value!r} timestamp={raw_ts!r}")
+            rows_done += len(chunk)
+            # Bloco + progresso na mesma transação: retomar nunca duplica nem perde linhas
+            with conn:
+                conn.executemany(INSERT_SQL, rows)
+                conn.execute("INSERT INTO import_progress (source, rows_done, updated_at) VALUES (?, ?, datetime('now')) "
+                             "ON CONFLICT(source) DO UPDATE SET rows_done = excluded.rows_done, updated_at = excluded.updated_at",
+                             (source, rows_done))
+            inserted += len(rows)
+            rejected += bad
+            elapsed = time.perf_counter() - started
+            rate = inserted / elapsed if elapsed > 0 else 0.0
+            print(f"{rows_done} linhas lidas | {inserted} inseridas | {rejected} rejeitadas | {rate:,.0f} linhas/s")
+
+        elapsed = time.perf_counter() - started
+        return inserted, rejected, elapsed
+    finally:
+        conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Importação em massa de registros de glicemia (CSV/NDJSON).")
+    parser.add_argument('path', help="Arquivo CSV ou NDJSON")
+    parser.add_argument('--user-id', type=int, required=True, help="ID do usuário dono dos registros")
+    parser.add_argument('--db', default=DEFAULT_DB_PATH, help=f"Caminho do banco SQLite (padrão: {DEFAULT_DB_PATH})")
+    parser.add_argument('--format', choices=['csv', 'ndjson'], help="Formato do arquivo (padrão: pela extensão)")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help="Linhas por bloco/transação")
+    parser.add_argument('--timezone', help="Fuso das datas sem fuso no arquivo (ex: America/Sao_Paulo); padrão UTC")
+    parser.add_argument('--date-format', default=DEFAULT_DATE_FORMAT,
+                        help="Formato das datas: ISO8601 (padrão), mixed (lento, detecta por linha) ou strftime, ex: %%d/%%m/%%Y %%H:%%M")
+    parser.add_argument('--epoch', action='store_true',
+                        help="Lê datas numéricas como epoch (segundos desde 1970, UTC); as demais seguem --date-format")
+    parser.add_argument('--restart', action='store_true', help="Ignora o progresso salvo e importa desde o início")
+    args = parser.parse_args(argv)
+
+    try:
+        inserted, rejected, elapsed = import_file(args.path, args.user_id, db_path=args.db, fmt=args.format,
+                                                  chunk_size=args.chunk_size, timezone=args.timezone,
+                                                  restart=args.restart, date_format=args.date_format,
+                                                  epoch=args.epoch)
+    except Exception as e:
+        print(f"Erro na importação: {e}")
+        return 1
+
+    rate = inserted / elapsed if elapsed > 0 else 0.0
+    print(f"Pronto. {inserted} registros inseridos, {rejected} rejeitados em {elapsed:.1f}s ({rate:,.0f} linhas/s).")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,144 @@
+# outbox.py
+# Fila de eventos local (outbox) para efeitos colaterais fora do caminho da requisição.
+#
+# Os endpoints gravam o evento na tabela outbox_event na MESMA transação do registro
+# (uma única commit por requisição). Um processo separado drena a fila em lotes
+# e executa as notificações. Entrega "at-least-once": um evento só é marcado como
+# processado depois que o handler termina sem erro.
+#
+# Executar o consumidor:  python outbox.py
+
+import os
+import json
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import or_, func
+from database import db, OutboxEvent
+
+OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', 100))
+OUTBOX_POLL_SECONDS = float(os.environ.get('OUTBOX_POLL_SECONDS', 2.0))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', 5))
+OUTBOX_RETRY_SECONDS = float(os.environ.get('OUTBOX_RETRY_SECONDS', 30))        # 30s, 60s, 120s, ...
+OUTBOX_MAX_BACKOFF_SECONDS = float(os.environ.get('OUTBOX_MAX_BACKOFF_SECONDS', 60))
+
+
+class RetryLater(Exception):
+    """Levantada por um handler para adiar o evento por `delay` segundos sem gastar uma tentativa."""
+    def __init__(self, delay: float, reason: str = ''):
+        super().__init__(reason or f"Adiado por {delay:.0f}s.")
+        self.delay = delay
+
+
+def enqueue_event(kind: str, payload: dict):
+    """Adiciona um evento na sessão atual. NÃO faz commit: quem chama faz a commit junto com o registro."""
+    event = OutboxEvent(kind=kind, payload=json.dumps(payload, default=str))
+    db.session.add(event)
+    return event
+
+
+def _record_failure(event, error: str, logger=None):
+    """Conta uma tentativa com falha: agenda nova tentativa ou, esgotado o limite, marca como falha definitiva."""
+    event.attempts += 1
+    event.last_error = error[:1000]
+    if event.attempts >= OUTBOX_MAX_ATTEMPTS:
+        # Dead-letter: não é mais tentado; aparece em /api/metrics e é removido pela retenção
+        event.failed_at = datetime.utcnow()
+        message = "Evento %s (%s) esgotou %s tentativas e foi marcado como falha: %s"
+        if logger:
+            logger.error(message, event.id, event.kind, event.attempts, event.last_error)
+        else:
+            print(message % (event.id, event.kind, event.attempts, event.last_error))
+    else:
+        event.next_attempt_at = datetime.utcnow() + timedelta(seconds=OUTBOX_RETRY_SECONDS * 2 ** (event.attempts - 1))
+
+
+def outbox_counts():
+    """Total de eventos pendentes e com falha definitiva (dead-letter), para métricas."""
+    pending = db.session.query(func.count(OutboxEvent.id))\
+                        .filter(OutboxEvent.processed_at.is_(None), OutboxEvent.failed_at.is_(None)).scalar()
+    failed = db.session.query(func.count(OutboxEvent.id)).filter(OutboxEvent.failed_at.isnot(None)).scalar()
+    return {'pending': pending, 'failed': failed}
+
+
+def drain_outbox(handlers: dict, batch_size: int = OUTBOX_BATCH_SIZE, logger=None):
+    """
+    Processa um lote de eventos pendentes (mais antigos primeiro).
+    Cada evento é confirmado com sua própria commit, junto com os eventos que o handler gerar;
+    se o handler falhar, o evento continua pendente e é repetido após um intervalo crescente,
+    até OUTBOX_MAX_ATTEMPTS tentativas (depois disso fica com failed_at preenchido).
+    Retorna o número de eventos processados com sucesso.
+    """
+    now = datetime.utcnow()
+    event_ids = [event_id for (event_id,) in db.session.query(OutboxEvent.id)
+                 .filter(OutboxEvent.processed_at.is_(None),
+                         OutboxEvent.failed_at.is_(None),
+                         OutboxEvent.attempts < OUTBOX_MAX_ATTEMPTS,
+                         or_(OutboxEvent.next_attempt_at.is_(None), OutboxEvent.next_attempt_at <= now))
+                 .order_by(OutboxEvent.id.asc()).limit(batch_size)]
+    done = 0
+    for event_id in event_ids:
+        event = db.session.get(OutboxEvent, event_id)
+        handler = handlers.get(event.kind)
+        if handler is None:
+            _record_failure(event, f"Nenhum handler para o tipo '{event.kind}'.", logger)
+            db.session.commit()
+            continue
+        try:
+            handler(json.loads(event.payload))
+        except RetryLater as e:
+            # Ex.: circuito do Telegram aberto. Não conta como tentativa, para OUTBOX_MAX_ATTEMPTS
+            # não se esgotar enquanto o circuito estiver aberto
+            db.session.rollback()
+            event = db.session.get(OutboxEvent, event_id)
+            event.last_error = str(e)[:1000]
+            event.next_attempt_at = datetime.utcnow() + timedelta(seconds=e.delay)
+        except Exception as e:
+            # Descarta o que o handler deixou na sessão e mantém o evento pendente
+            db.session.rollback()
+            event = db.session.get(OutboxEvent, event_id)
+            if logger:
+                logger.exception("Erro ao processar evento %s (%s): %s", event.id, event.kind, e)
+            _record_failure(event, str(e), logger)
+        else:
+            event.attempts += 1
+            event.processed_at = datetime.utcnow()
+            event.last_error = None
+            done += 1
+        db.session.commit()
+    return done
+
+
+def run_worker(app, handlers: dict, batch_size: int = OUTBOX_BATCH_SIZE, poll_seconds: float = OUTBOX_POLL_SECONDS,
+               after_drain=None):
+    """
+    Loop do consumidor: drena a fila continuamente; dorme quando não há eventos.
+    after_drain (opcional) é chamado após cada lote, ex.: para gravar métricas do worker.
+    """
+    with app.app_context():
+        app.logger.info("Outbox worker iniciado (lote=%s, intervalo=%ss).", batch_size, poll_seconds)
+        error_streak = 0
+        while True:
+            try:
+                processed = drain_outbox(handlers, batch_size, logger=app.logger)
+                if after_drain:
+                    after_drain()
+            except Exception as e:
+                # Erros de banco (ex.: "database is locked" durante o VACUUM da retenção) não derrubam o consumidor
+                db.session.rollback()
+                error_streak += 1
+                delay = min(poll_seconds * 2 ** error_streak, OUTBOX_MAX_BACKOFF_SECONDS)
+                app.logger.exception("Erro ao drenar a outbox; nova tentativa em %ss: %s", delay, e)
+                time.sleep(delay)
+                continue
+            error_streak = 0
+            if processed < batch_size:
+                time.sleep(poll_seconds)
+
+
+if __name__ == '__main__':
+    # Import tardio para evitar import circular (app.py importa enqueue_event).
+    # Usa o módulo importado `outbox`, não este __main__: senão RetryLater levantada pelos handlers
+    # (outbox.RetryLater) seria outra classe e não seria reconhecida por drain_outbox.
+    import outbox
+    from app import APP, OUTBOX_HANDLERS, save_worker_metrics
+    outbox.run_worker(APP, OUTBOX_HANDLERS, after_drain=save_worker_metrics)
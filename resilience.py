@@ -0,0 +1,99 @@
+# resilience.py
+# Circuit breaker para chamadas externas (ex.: API do Telegram).
+#
+# Estados:
+#   closed    -> chamadas liberadas; falhas consecutivas são contadas
+#   open      -> após failure_threshold falhas seguidas, as chamadas são puladas na hora
+#   half_open -> passado reset_timeout, uma chamada de teste é liberada; sucesso fecha, falha reabre
+#
+# O estado é por processo. Quem envia ao Telegram é o consumidor da outbox, que grava
+# snapshot() na tabela metric_snapshot para /api/metrics (ver save_worker_metrics em app.py).
+
+import time
+import threading
+
+
+class CircuitOpenError(Exception):
+    """Chamada pulada porque o circuito está aberto; retry_after = segundos até a próxima chamada de teste."""
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Circuito '{name}' aberto; nova tentativa em {retry_after:.0f}s.")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 60.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = 'closed'
+        self._consecutive_failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        # Contadores expostos em /api/metrics
+        self.successes = 0
+        self.failures = 0
+        self.skipped = 0
+        self.times_opened = 0
+
+    def allow(self) -> bool:
+        """Retorna True se a chamada pode ser feita; False (e registra como pulada) se o circuito está aberto."""
+        with self._lock:
+            if self._state == 'open' and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._state = 'half_open'
+                self._trial_in_flight = False
+            if self._state == 'closed':
+                return True
+            if self._state == 'half_open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self.skipped += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.successes += 1
+            self._consecutive_failures = 0
+            self._state = 'closed'
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._consecutive_failures += 1
+            if self._state == 'half_open' or self._consecutive_failures >= self.failure_threshold:
+                if self._state != 'open':
+                    self.times_opened += 1
+                self._state = 'open'
+                self._opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+    def retry_after(self) -> float:
+        """Segundos até o circuito liberar uma nova chamada de teste (0 se já está liberando)."""
+        with self._lock:
+            if self._state == 'open':
+                return max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+            if self._state == 'half_open' and self._trial_in_flight:
+                # Aguarda o resultado da chamada de teste em andamento
+                return min(self.reset_timeout, 1.0)
+            return 0.0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    def snapshot(self) -> dict:
+        """Estado e contadores atuais, para métricas."""
+        with self._lock:
+            return {
+                'name': self.name,
+                'state': self._state,
+                'consecutive_failures': self._consecutive_failures,
+                'failure_threshold': self.failure_threshold,
+                'reset_timeout': self.reset_timeout,
+                'successes': self.successes,
+                'failures': self.failures,
+                'skipped': self.skipped,
+                'times_opened': self.times_opened,
+            }
@@ -0,0 +1,177 @@
+# retention.py
+# Retenção de dados: arquiva leituras antigas de glicemia em arquivos comprimidos por usuário,
+# arquiva/remove mensagens antigas do chat e devolve o espaço livre ao disco (incremental VACUUM).
+#
+# Os arquivos ficam em ARCHIVE_DIR como JSON Lines comprimido (gzip), um por usuário:
+#   glucose_user_<id>.jsonl.gz  e  chat_messages.jsonl.gz
+# Cada execução acrescenta um novo membro gzip ao arquivo (o gzip lê todos em sequência).
+#
+# Executar:  python retention.py   (ex.: diariamente via cron)
+
+import os
+import gzip
+import json
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from database import db, GlucoseRecord, ChatMessage, OutboxEvent
+
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', 'archive')
+GLUCOSE_RETENTION_DAYS = int(os.environ.get('GLUCOSE_RETENTION_DAYS', 365))
+CHAT_RETENTION_DAYS = int(os.environ.get('CHAT_RETENTION_DAYS', 90))
+CHAT_ARCHIVE_ENABLED = str(os.environ.get('CHAT_ARCHIVE_ENABLED', '1')).lower() in ('1', 'true', 'yes')
+OUTBOX_RETENTION_DAYS = int(os.environ.get('OUTBOX_RETENTION_DAYS', 7))
+OUTBOX_FAILED_RETENTION_DAYS = int(os.environ.get('OUTBOX_FAILED_RETENTION_DAYS', 30))  # dead-letter fica mais tempo para análise
+RETENTION_BATCH_SIZE = int(os.environ.get('RETENTION_BATCH_SIZE', 5000))
+VACUUM_PAGES = int(os.environ.get('VACUUM_PAGES', 0))  # 0 = libera todas as páginas livres
+
+
+def glucose_archive_path(user_id):
+    return os.path.join(ARCHIVE_DIR, f"glucose_user_{user_id}.jsonl.gz")
+
+
+def chat_archive_path():
+    return os.path.join(ARCHIVE_DIR, "chat_messages.jsonl.gz")
+
+
+def _append_archive(path, rows):
+    """Acrescenta linhas ao arquivo gzip e força a gravação em disco antes de apagar do banco."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'ab') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='wb') as gz:
+            for row in rows:
+                gz.write((json.dumps(row, ensure_ascii=False) + "\n").encode('utf-8'))
+        raw.flush()
+        os.fsync(raw.fileno())
+
+
+def _read_archive(path):
+    if not os.path.exists(path):
+        return []
+    rows = []
+    with gzip.open(path, 'rt', encoding='utf-8') as gz:
+        for line in gz:
+            if line.strip():
+                rows.append(json.loads(line))
+    return rows
+
+
+def load_archived_records(user_id):
+    """
+    Lê os registros de glicemia arquivados do usuário, no mesmo formato de /api/records.
+    Se uma execução foi interrompida entre arquivar e apagar, a mesma linha aparece duas vezes
+    e é descartada. A comparação é pela linha inteira, não só pelo id: glucose_record não usa
+    AUTOINCREMENT, então o SQLite reaproveita ids de leituras já arquivadas.
+    """
+    unique = {json.dumps(row, sort_keys=True): row for row in _read_archive(glucose_archive_path(user_id))}
+    return sorted(unique.values(), key=lambda row: row['timestamp'])
+
+
+def archive_glucose_records(cutoff, batch_size=RETENTION_BATCH_SIZE):
+    """Move leituras anteriores a cutoff para os arquivos por usuário. Retorna o total arquivado."""
+    user_ids = [uid for (uid,) in db.session.query(GlucoseRecord.user_id)
+                                             .filter(GlucoseRecord.timestamp < cutoff).distinct()]
+    total = 0
+    for user_id in user_ids:
+        while True:
+            records = GlucoseRecord.query.filter(GlucoseRecord.user_id == user_id,
+                                                 GlucoseRecord.timestamp < cutoff)\
+                                         .order_by(GlucoseRecord.timestamp.asc()).limit(batch_size).all()
+            if not records:
+                break
+            _append_archive(glucose_archive_path(user_id), [
+                {
+                    'id': r.id,
+                    'value': r.value,
+                    'timestamp': r.timestamp.isoformat(),
+                    'meal_time': r.meal_time,
+                    'exercise_time': r.exercise_time,
+                    'symptoms': r.symptoms
+                } for r in records
+            ])
+            ids = [r.id for r in records]
+            GlucoseRecord.query.filter(GlucoseRecord.id.in_(ids)).delete(synchronize_session=False)
+            db.session.commit()
+            total += len(ids)
+    return total
+
+
+def prune_chat_messages(cutoff, archive=CHAT_ARCHIVE_ENABLED, batch_size=RETENTION_BATCH_SIZE):
+    """Remove mensagens do chat anteriores a cutoff (arquivando antes, se habilitado). Retorna o total."""
+    total = 0
+    while True:
+        messages = ChatMessage.query.filter(ChatMessage.timestamp < cutoff)\
+                                    .order_by(ChatMessage.timestamp.asc()).limit(batch_size).all()
+        if not messages:
+            break
+        if archive:
+            _append_archive(chat_archive_path(), [
+                {
+                    'id': m.id,
+                    'user_id': m.user_id,
+                    'username': m.username,
+                    'content': m.content,
+                    'timestamp': m.timestamp.isoformat()
+                } for m in messages
+            ])
+        ids = [m.id for m in messages]
+        ChatMessage.query.filter(ChatMessage.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        total += len(ids)
+    return total
+
+
+def prune_outbox_events(cutoff):
+    """Apaga eventos da outbox já processados antes de cutoff. Retorna o total."""
+    total = OutboxEvent.query.filter(OutboxEvent.processed_at.isnot(None),
+                                     OutboxEvent.processed_at < cutoff).delete(synchronize_session=False)
+    db.session.commit()
+    return total
+
+
+def prune_failed_outbox_events(cutoff):
+    """Apaga eventos da outbox que esgotaram as tentativas (dead-letter) antes de cutoff. Retorna o total."""
+    total = OutboxEvent.query.filter(OutboxEvent.failed_at.isnot(None),
+                                     OutboxEvent.failed_at < cutoff).delete(synchronize_session=False)
+    db.session.commit()
+    return total
+
+
+def incremental_vacuum(pages=VACUUM_PAGES):
+    """
+    Devolve páginas livres ao sistema de arquivos sem bloquear o banco por um VACUUM completo.
+    Na primeira execução o banco é convertido para auto_vacuum=INCREMENTAL (exige um VACUUM único).
+    """
+    # VACUUM não pode rodar dentro de uma transação
+    with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if conn.execute(text("PRAGMA auto_vacuum")).scalar() != 2:
+            conn.execute(text("PRAGMA auto_vacuum = INCREMENTAL"))
+            conn.execute(text("VACUUM"))
+        free_pages = conn.execute(text("PRAGMA freelist_count")).scalar()
+        # Pelo sqlite3 do Python, execute() libera só uma página por chamada; executescript() roda até o fim
+        conn.connection.driver_connection.executescript(
+            f"PRAGMA incremental_vacuum({int(pages)});" if pages else "PRAGMA incremental_vacuum;")
+        free_pages -= conn.execute(text("PRAGMA freelist_count")).scalar()
+    return free_pages
+
+
+def run_retention(now=None):
+    """Executa todas as etapas de retenção e retorna um resumo."""
+    now = now or datetime.utcnow()
+    summary = {
+        'glucose_archived': archive_glucose_records(now - timedelta(days=GLUCOSE_RETENTION_DAYS)),
+        'chat_pruned': prune_chat_messages(now - timedelta(days=CHAT_RETENTION_DAYS)),
+        'outbox_pruned': prune_outbox_events(now - timedelta(days=OUTBOX_RETENTION_DAYS)),
+        'outbox_failed_pruned': prune_failed_outbox_events(now - timedelta(days=OUTBOX_FAILED_RETENTION_DAYS)),
+    }
+    summary['pages_freed'] = incremental_vacuum()
+    return summary
+
+
+if __name__ == '__main__':
+    from app import APP
+    with APP.app_context():
+        result = run_retention()
+        print(f"Retenção concluída: {result['glucose_archived']} leituras arquivadas, "
+              f"{result['chat_pruned']} mensagens removidas, {result['outbox_pruned']} eventos processados e "
+              f"{result['outbox_failed_pruned']} com falha removidos da outbox, "
+              f"{result['pages_freed']} páginas liberadas.")